@@ -1,12 +1,25 @@
 import os
 import json
-import math
+import functools
 import logging
+import itertools
 import datetime as dt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
+import pandas as pd
 import pymysql
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson parses JSON several times faster; fall back to the stdlib json if it is not packaged
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -40,22 +53,71 @@ LAYER_2025 = {
     "2025-12": 11,
 }
 
-CHUNK = 2000  
+# month_key -> (MapServer URL, layer ID)
+LAYERS = {
+    **{k: (URL_2024, v) for k, v in LAYER_2024.items()},
+    **{k: (URL_2025, v) for k, v in LAYER_2025.items()},
+}
+
+DAY_MS = 86_400_000
+
+# Object IDs per feature query; stays below the layers' maxRecordCount (2000)
+# and matches BATCH, so each query result is written as one INSERT
+CHUNK = 800
+
+# ArcGIS attributes read by transform_rows; also the outFields of every query
+SOURCE_FIELDS = [
+    "OBJECTID",
+    "ISSUE_DATE",
+    "ISSUING_AGENCY_NAME",
+    "ACCIDENT_INDICATOR",
+    "LOCATION",
+    "VIOLATION_CODE",
+    "VIOLATION_PROCESS_DESC",
+    "FINE_AMOUNT",
+    "TOTAL_PAID",
+    "LATITUDE",
+    "LONGITUDE",
+]
+
+# ID lookups and feature queries for every day share one thread pool of this size, which is
+# also the keep-alive pool size, so no request opens a connection of its own.
+MAX_CONCURRENT_REQUESTS = 8
+
+# At most this many ID-group results are fetched ahead of the inserts (bounds memory),
+# and ID lookups run at most this many dates ahead
+MAX_PENDING_GROUPS = 2 * MAX_CONCURRENT_REQUESTS
+ID_LOOKAHEAD_DATES = 4
+
+# Rows per multi-row INSERT statement, and ID groups per commit (commits wait for a date boundary)
+BATCH = 800
+COMMIT_EVERY = 10
+
+
+# HTTP session: keep-alive connections and retries shared by every ArcGIS call
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=MAX_CONCURRENT_REQUESTS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # ArcGIS queries are read-only, so retrying a POST is safe
+            allowed_methods=frozenset(["GET", "POST"]),
+        ),
+    ),
+)
 
 
 def get_layer_url(month_key: str):
     """Select the corresponding MapServer+layer ID based on the monthly key"""
-    if month_key.startswith("2024"):
-        layer_id = LAYER_2024.get(month_key)
-        base_url = URL_2024
-    else:
-        layer_id = LAYER_2025.get(month_key)
-        base_url = URL_2025
-
-    if layer_id is None:
-        raise ValueError(f"No layer mapping for month_key={month_key}")
-
-    return base_url, layer_id
+    try:
+        return LAYERS[month_key]
+    except KeyError:
+        raise ValueError(f"No layer mapping for month_key={month_key}") from None
 
 
 def date_to_month_key(d: dt.date) -> str:
@@ -64,26 +126,28 @@ def date_to_month_key(d: dt.date) -> str:
 
 def date_to_ms_range(d: dt.date):
     """Convert a certain day to the millisecond interval of ArcGIS ISSUE-DATE [start, end)"""
-    start = dt.datetime(d.year, d.month, d.day)
-    end = start + dt.timedelta(days=1)
-    epoch = dt.datetime(1970, 1, 1)
-    start_ms = int((start - epoch).total_seconds() * 1000)
-    end_ms = int((end - epoch).total_seconds() * 1000)
-    return start_ms, end_ms
+    start_ms = int(dt.datetime(d.year, d.month, d.day, tzinfo=dt.timezone.utc).timestamp() * 1000)
+    return start_ms, start_ms + DAY_MS
 
 
 
 # 1. RDS connetion (Secrets Manager)
 
 
+# Created once per container, so warm invocations skip the client setup
+SECRETS_CLIENT = boto3.session.Session().client(
+    service_name="secretsmanager",
+    region_name=os.environ["AWS_REGION"],  # us-east-2
+)
+
+
+@functools.lru_cache(maxsize=1)
 def get_db_config():
+    """Read the DB secret once per container; warm invocations reuse it"""
     secret_name = os.environ["DB_SECRET_NAME"]  # mis664_project_db_secret
-    region_name = os.environ["AWS_REGION"]      # us-east-2
 
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
-    resp = client.get_secret_value(SecretId=secret_name)
-    secret = json.loads(resp["SecretString"])
+    resp = SECRETS_CLIENT.get_secret_value(SecretId=secret_name)
+    secret = json_loads(resp["SecretString"])
 
     # Some are called dbname, some are called dbInstanceIdentifier, and some are called database.
     db_name = (
@@ -101,8 +165,7 @@ def get_db_config():
     }
 
 
-def get_connection():
-    cfg = get_db_config()
+def _connect(cfg):
     return pymysql.connect(
         host=cfg["host"],
         user=cfg["user"],
@@ -110,9 +173,37 @@ def get_connection():
         db=cfg["db"],
         port=cfg["port"],
         cursorclass=pymysql.cursors.DictCursor,
+        autocommit=False,
     )
 
 
+def get_connection():
+    try:
+        return _connect(get_db_config())
+    except pymysql.err.OperationalError:
+        # The cached secret may be stale after a rotation: re-read it once
+        get_db_config.cache_clear()
+        return _connect(get_db_config())
+
+
+# Kept open between invocations of a warm container
+_CONN = None
+
+
+def get_reusable_connection():
+    """Reuse the warm container's connection if it still answers a ping"""
+    global _CONN
+    if _CONN is not None and _CONN.open:
+        try:
+            _CONN.ping(reconnect=True)
+            return _CONN
+        except pymysql.MySQLError:
+            pass
+
+    _CONN = get_connection()
+    return _CONN
+
+
 
 # 2. Calculate the date range that requires increment
 
@@ -150,84 +241,143 @@ def get_date_range(conn):
 # 3. Capture violation data by day from ArcGIS
 
 
-def fetch_violations_for_date(d: dt.date):
-    """
-    Click 'Day' to pull the record of ISSUE-DATE in ArcGIS for that day
-    """
+def arcgis_query(url: str, params: dict):
+    # Sent as a form POST: an OBJECTID IN (...) filter is too long for a query string
+    resp = SESSION.post(url, data=params, timeout=30)
+    resp.raise_for_status()
+    js = json_loads(resp.content)
+    # ArcGIS reports most query failures as HTTP 200 with an "error" body
+    if "error" in js:
+        raise RuntimeError(f"ArcGIS query failed: {js['error']}")
+    return js
+
+
+def day_query(d: dt.date):
+    """Return (month_key, query URL, ISSUE_DATE filter) for one day"""
     month_key = date_to_month_key(d)
     base_url, layer_id = get_layer_url(month_key)
-    url = f"{base_url}/{layer_id}/query"
-
     start_ms, end_ms = date_to_ms_range(d)
+    where = f"ISSUE_DATE >= {start_ms} AND ISSUE_DATE < {end_ms}"
+    return month_key, f"{base_url}/{layer_id}/query", where
 
-    offset = 0
-    all_rows = []
-
-    while True:
-        params = {
-            "where": f"ISSUE_DATE >= {start_ms} AND ISSUE_DATE < {end_ms}",
-            "outFields": "*",
-            "returnGeometry": "false",
-            "f": "json",
-            "resultOffset": offset,
-            "resultRecordCount": CHUNK,
-        }
 
-        resp = requests.get(url, params=params, timeout=30)
-        resp.raise_for_status()
-        js = resp.json()
+def get_object_ids_for_date(d: dt.date):
+    """
+    Return (day_query(d), all OBJECTIDs of the day); returnIdsOnly is not capped
+    by maxRecordCount. The query is handed on so ID groups do not rebuild it
+    """
+    query = day_query(d)
+    _, url, where = query
+    params = {
+        "where": where,
+        "returnIdsOnly": "true",
+        "f": "json",
+    }
+    return query, sorted(arcgis_query(url, params).get("objectIds") or [])
 
-        features = js.get("features", [])
-        if not features:
-            break
 
-        rows = [f["attributes"] for f in features]
-        all_rows.extend(rows)
+def fetch_by_object_ids(d: dt.date, query: tuple, object_ids: list):
+    month_key, url, _ = query
+    params = {
+        "where": f"OBJECTID IN ({','.join(map(str, object_ids))})",
+        "outFields": ",".join(SOURCE_FIELDS),
+        "returnGeometry": "false",
+        "f": "json",
+    }
+    js = arcgis_query(url, params)
+    features = js.get("features", [])
+    # A group larger than the layer's maxRecordCount comes back truncated
+    if js.get("exceededTransferLimit") or len(features) != len(object_ids):
+        raise RuntimeError(
+            f"{d}: got {len(features)} of {len(object_ids)} rows "
+            f"for OBJECTID {object_ids[0]}..{object_ids[-1]}"
+        )
+    logger.info(
+        f"{d} ({month_key}): fetched {len(features)} rows "
+        f"for OBJECTID {object_ids[0]}..{object_ids[-1]}"
+    )
+    return [f["attributes"] for f in features]
 
-        logger.info(f"{d} ({month_key}): fetched {len(features)} rows at offset {offset}")
 
-        if len(features) < CHUNK:
-            break
+def fetch_violations(dates):
+    """
+    Click 'Day' to pull the record of ISSUE-DATE in ArcGIS for each day
+
+    Yields (date, raw_rows, month_key, last) for every CHUNK-sized ID group, in
+    date order; last is True on the final group of a date (a date without
+    records yields a single empty group). Queries run on one shared thread
+    pool, but at most MAX_PENDING_GROUPS groups are submitted ahead of the
+    consumer, so memory holds a bounded number of groups however slow the
+    inserts are. If any lookup fails, the error is logged and the generator
+    stops: the dates after it are left for the next run.
+    """
+    pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+    failed = False
+
+    def iter_groups():
+        """(date, query, object_ids, last) in date order; ID lookups run a few dates ahead"""
+        nonlocal failed
+        date_iter = iter(dates)
+        lookups = deque(
+            (d, pool.submit(get_object_ids_for_date, d))
+            for d in itertools.islice(date_iter, ID_LOOKAHEAD_DATES)
+        )
+        while lookups:
+            d, future = lookups.popleft()
+            for next_d in itertools.islice(date_iter, 1):
+                lookups.append((next_d, pool.submit(get_object_ids_for_date, next_d)))
 
-        offset += CHUNK
+            try:
+                query, object_ids = future.result()
+            except Exception as e:
+                logger.error(f"Error processing date {d}: {e}")
+                failed = True
+                return
 
-    return all_rows, month_key
+            if not object_ids:
+                logger.info(f"{d}: no records in ArcGIS")
+                yield d, query, [], True
+                continue
 
+            for i in range(0, len(object_ids), CHUNK):
+                yield d, query, object_ids[i:i + CHUNK], i + CHUNK >= len(object_ids)
 
+    groups = iter_groups()
+    window = deque()  # (date, month_key, future or None, last) of submitted groups, oldest first
 
-# 4. Field cleaning+mapping to the behaviors table
+    def fill_window():
+        for d, query, ids, last in itertools.islice(groups, MAX_PENDING_GROUPS - len(window)):
+            future = pool.submit(fetch_by_object_ids, d, query, ids) if ids else None
+            window.append((d, query[0], future, last))
 
-
-def to_float_safe(x):
-    if x is None:
-        return None
     try:
-        f = float(x)
-        if math.isnan(f):
-            return None
-        return f
-    except (TypeError, ValueError):
-        return None
+        fill_window()
+        while window:
+            d, month_key, future, last = window.popleft()
+            try:
+                raw_rows = future.result() if future else []
+            except Exception as e:
+                logger.error(f"Error processing date {d}: {e}")
+                failed = True
+                return
+            fill_window()
 
+            yield d, raw_rows, month_key, last
+    finally:
+        if failed:
+            logger.error("Stopping the fetch; later dates are left for the next run")
+        # Once the consumer stops, nothing still queued is needed
+        pool.shutdown(wait=True, cancel_futures=True)
 
-def ms_to_datetime(ms_value):
-    """
-    ArcGIS ISSUE_DATE: Millisecond timestamp -> Python datetime + date
-    """
-    if ms_value is None:
-        return None, None
-    try:
-        sec = float(ms_value) / 1000.0
-        dt_val = dt.datetime.utcfromtimestamp(sec)
-        return dt_val, dt_val.date()
-    except Exception:
-        return None, None
 
 
-def transform_row(r: dict, month_key: str):
+# 4. Field cleaning+mapping to the behaviors table
+
+
+def transform_rows(raw_rows: list, month_key: str):
     """
-    Put ArcGIS attributes on one line ->violations table on one line tuple
-    
+    Put ArcGIS attributes -> violations table tuples, converting whole columns at once
+
     - OBJECTID
     - ISSUE_DATE (ms)
     - ISSUING_AGENCY_NAME
@@ -240,28 +390,39 @@ def transform_row(r: dict, month_key: str):
     - LATITUDE
     - LONGITUDE
     """
-
-    issue_ms = r.get("ISSUE_DATE")
-    issue_date, violation_date = ms_to_datetime(issue_ms)
-
-    obj_id = r.get("OBJECTID")
-    violation_id = f"{month_key}_{obj_id}"
-
-    issuing_agency_name = r.get("ISSUING_AGENCY_NAME")
-    accident_indicator = r.get("ACCIDENT_INDICATOR")
-    location = r.get("LOCATION")
-    violation_code = r.get("VIOLATION_CODE")
-    violation_desc = r.get("VIOLATION_PROCESS_DESC")
-
-    fine_amount = to_float_safe(r.get("FINE_AMOUNT"))
-    total_paid = to_float_safe(r.get("TOTAL_PAID"))
-    latitude = to_float_safe(r.get("LATITUDE"))
-    longitude = to_float_safe(r.get("LONGITUDE"))
-
-    # The 'month' field is' YYYY-MM '
-    month = month_key
-
-    return (
+    if not raw_rows:
+        return []
+
+    src = pd.DataFrame(raw_rows, columns=SOURCE_FIELDS)
+
+    # ISSUE_DATE is a UTC millisecond timestamp; unparseable values become NaT
+    issue_ms = pd.to_numeric(src["ISSUE_DATE"], errors="coerce")
+    issue_date = pd.to_datetime(issue_ms, unit="ms", utc=True, errors="coerce").dt.tz_localize(None)
+
+    df = pd.DataFrame({
+        "violation_id": month_key + "_" + src["OBJECTID"].astype("Int64").astype(str),
+        "issue_date": issue_date,
+        "violation_date": issue_date.dt.date,
+        "issuing_agency_name": src["ISSUING_AGENCY_NAME"],
+        "accident_indicator": src["ACCIDENT_INDICATOR"],
+        "location": src["LOCATION"],
+        "violation_code": src["VIOLATION_CODE"],
+        "violation_desc": src["VIOLATION_PROCESS_DESC"],
+        "fine_amount": pd.to_numeric(src["FINE_AMOUNT"], errors="coerce"),
+        "total_paid": pd.to_numeric(src["TOTAL_PAID"], errors="coerce"),
+        "latitude": pd.to_numeric(src["LATITUDE"], errors="coerce"),
+        "longitude": pd.to_numeric(src["LONGITUDE"], errors="coerce"),
+        # The 'month' field is' YYYY-MM '
+        "month": month_key,
+    })
+
+    # NaN / NaT -> NULL
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+INSERT_VIOLATIONS_SQL = """
+    INSERT IGNORE INTO violations (
         violation_id,
         issue_date,
         violation_date,
@@ -274,40 +435,33 @@ def transform_row(r: dict, month_key: str):
         total_paid,
         latitude,
         longitude,
-        month,
-    )
+        month
+    ) VALUES
+"""
+INSERT_VIOLATIONS_ROW = "(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)"
+
+# Built once: every batch but the last one of a day has exactly BATCH rows
+INSERT_VIOLATIONS_BATCH_SQL = INSERT_VIOLATIONS_SQL + ",".join([INSERT_VIOLATIONS_ROW] * BATCH)
 
 
 def insert_violations(conn, rows):
     """
     rows: list[tuple]， The order must correspond one-to-one with the fields in the INSERT
+
+    Does not commit: lambda_handler commits whole dates, several per transaction.
     """
     if not rows:
         return 0
 
-    sql = """
-        INSERT IGNORE INTO violations (
-            violation_id,
-            issue_date,
-            violation_date,
-            issuing_agency_name,
-            accident_indicator,
-            location,
-            violation_code,
-            violation_desc,
-            fine_amount,
-            total_paid,
-            latitude,
-            longitude,
-            month
-        ) VALUES (
-            %s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s
-        )
-    """
-
+    # One multi-row INSERT per BATCH rows keeps each packet well under max_allowed_packet
     with conn.cursor() as cur:
-        cur.executemany(sql, rows)
-    conn.commit()
+        for start in range(0, len(rows), BATCH):
+            chunk = rows[start:start + BATCH]
+            if len(chunk) == BATCH:
+                sql = INSERT_VIOLATIONS_BATCH_SQL
+            else:
+                sql = INSERT_VIOLATIONS_SQL + ",".join([INSERT_VIOLATIONS_ROW] * len(chunk))
+            cur.execute(sql, list(itertools.chain.from_iterable(chunk)))
     return len(rows)
 
 
@@ -316,7 +470,7 @@ def insert_violations(conn, rows):
 
 
 def lambda_handler(event, context):
-    conn = get_connection()
+    conn = get_reusable_connection()
     try:
         start_date, end_date = get_date_range(conn)
         if start_date is None:
@@ -326,33 +480,60 @@ def lambda_handler(event, context):
 
         logger.info(f"Fetching violations from {start_date} to {end_date}")
 
+        dates = []
         cur_date = start_date
+        while cur_date <= end_date:
+            dates.append(cur_date)
+            cur_date += dt.timedelta(days=1)
+
         total_inserted = 0
+        uncommitted = 0
+        last_loaded = None
+        open_date = None
+
+        # Dates arrive in order and are committed whole: get_date_range resumes
+        # from MAX(violation_date), so no commit may expose a date past a gap.
+        # Fetching runs on worker threads; inserts stay on this thread only,
+        # since the pymysql connection must not be shared between threads.
+        for d, raw_rows, month_key, last in fetch_violations(dates):
+            if open_date is None:
+                # A failure while loading this date rolls back to here
+                with conn.cursor() as cur:
+                    cur.execute("SAVEPOINT date_start")
+                open_date, date_inserted = d, 0
 
-        while cur_date <= end_date:
             try:
-                logger.info(f"==== {cur_date} ====")
-                raw_rows, month_key = fetch_violations_for_date(cur_date)
-
                 # Convert to a tuple list that conforms to the table structure
-                rows = [transform_row(r, month_key) for r in raw_rows]
-
+                rows = transform_rows(raw_rows, month_key)
                 inserted = insert_violations(conn, rows)
-                total_inserted += inserted
+            except Exception as e:
+                logger.error(f"Error processing date {d}: {e}")
+                break
 
-                logger.info(
-                    f"{cur_date}: fetched {len(raw_rows)} rows, "
-                    f"inserted {inserted} into violations"
-                )
+            date_inserted += inserted
+            uncommitted += 1
+            logger.info(f"{d}: fetched {len(raw_rows)} rows, inserted {inserted} into violations")
 
-            except Exception as e:
-                logger.error(f"Error processing date {cur_date}: {e}")
+            if last:
+                total_inserted += date_inserted
+                last_loaded, open_date = d, None
 
-            cur_date += dt.timedelta(days=1)
+                # One commit per COMMIT_EVERY ID groups, always at a date boundary
+                if uncommitted >= COMMIT_EVERY:
+                    conn.commit()
+                    uncommitted = 0
+
+        if open_date is not None:
+            # Drop the partly loaded date so the next run fetches it again
+            with conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT date_start")
+            logger.error(f"{open_date}: not fully loaded; it and later dates are left for the next run")
+
+        conn.commit()
 
         result_msg = (
             f"Inserted {total_inserted} rows into violations "
-            f"from {start_date} to {end_date}"
+            f"from {start_date} to {end_date} (complete through {last_loaded})"
         )
         logger.info(result_msg)
 
@@ -362,4 +543,9 @@ def lambda_handler(event, context):
         }
 
     finally:
-        conn.close()
+        # The connection stays open for the next invocation; end any open
+        # transaction so its snapshot does not leak into the next run
+        try:
+            conn.rollback()
+        except pymysql.MySQLError:
+            pass
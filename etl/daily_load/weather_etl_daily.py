@@ -1,27 +1,62 @@
 import os
 import json
+import functools
 import logging
 import datetime as dt
 
 import boto3
 import pymysql
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson parses JSON several times faster; fall back to the stdlib json if it is not packaged
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Days per Visual Crossing request, as in the history load
+CHUNK_DAYS = 15
+
+
+# HTTP session: keep-alive connections and retries shared by every Visual Crossing call
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        ),
+    ),
+)
+
 
 # 1. RDS connetion (Secrets Manager)
 
 
+# Created once per container, so warm invocations skip the client setup
+SECRETS_CLIENT = boto3.session.Session().client(
+    service_name="secretsmanager",
+    region_name=os.environ["AWS_REGION"],  # us-east-2
+)
+
+
+@functools.lru_cache(maxsize=1)
 def get_db_config():
+    """Read the DB secret once per container; warm invocations reuse it"""
     secret_name = os.environ["DB_SECRET_NAME"]   # mis664_project_db_secret
-    region_name = os.environ["AWS_REGION"]       # us-east-2
 
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
-    resp = client.get_secret_value(SecretId=secret_name)
-    secret = json.loads(resp["SecretString"])
+    resp = SECRETS_CLIENT.get_secret_value(SecretId=secret_name)
+    secret = json_loads(resp["SecretString"])
 
     # Try to get the database name from the Secret; if it's not available, use an environment variable or a default value.
     db_name = (
@@ -41,8 +76,7 @@ def get_db_config():
 
 
 
-def get_connection():
-    cfg = get_db_config()
+def _connect(cfg):
     return pymysql.connect(
         host=cfg["host"],
         user=cfg["user"],
@@ -53,6 +87,33 @@ def get_connection():
     )
 
 
+def get_connection():
+    try:
+        return _connect(get_db_config())
+    except pymysql.err.OperationalError:
+        # The cached secret may be stale after a rotation: re-read it once
+        get_db_config.cache_clear()
+        return _connect(get_db_config())
+
+
+# Kept open between invocations of a warm container
+_CONN = None
+
+
+def get_reusable_connection():
+    """Reuse the warm container's connection if it still answers a ping"""
+    global _CONN
+    if _CONN is not None and _CONN.open:
+        try:
+            _CONN.ping(reconnect=True)
+            return _CONN
+        except pymysql.MySQLError:
+            pass
+
+    _CONN = get_connection()
+    return _CONN
+
+
 # 2. Calculate the date range that requires increments (weather_daily)
 
 
@@ -83,17 +144,29 @@ def get_date_range(conn):
     return start_date, end_date
 
 
+def create_date_ranges(start_date, end_date, chunk_days=CHUNK_DAYS):
+    """Split [start_date, end_date] into chunks of at most chunk_days days, in order"""
+    ranges = []
+    cur = start_date
+    while cur <= end_date:
+        chunk_end = min(cur + dt.timedelta(days=chunk_days - 1), end_date)
+        ranges.append((cur, chunk_end))
+        cur = chunk_end + dt.timedelta(days=1)
+    return ranges
 
 
-# 3. Call the Visual Crossing API to get the weather for the current day
 
 
-def fetch_weather_for_date(d: dt.date):
+# 3. Call the Visual Crossing API to get the weather for a date range
+
+
+def fetch_weather_range(start_date: dt.date, end_date: dt.date):
+    """One timeline request covers every day in [start_date, end_date] (at most CHUNK_DAYS days)"""
     api_key = os.environ["WEATHER_API_KEY"]
     location = os.environ["WEATHER_LOCATION"]
 
     base_url = "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline"
-    url = f"{base_url}/{location}/{d.isoformat()}"
+    url = f"{base_url}/{location}/{start_date.isoformat()}/{end_date.isoformat()}"
 
     params = {
         "unitGroup": "metric",
@@ -102,21 +175,23 @@ def fetch_weather_for_date(d: dt.date):
         "contentType": "json",
     }
 
-    logger.info(f"[DEBUG] Calling VisualCrossing for {d} ...")
+    logger.info(f"[DEBUG] Calling VisualCrossing for {start_date} -> {end_date} ...")
 
-    resp = requests.get(url, params=params, timeout=5)  # First, use a small timeout of 5 seconds
-    logger.info(f"[DEBUG] VisualCrossing responded for {d} with status {resp.status_code}")
+    resp = SESSION.get(url, params=params, timeout=30)
+    logger.info(f"[DEBUG] VisualCrossing responded with status {resp.status_code}")
 
     resp.raise_for_status()
-    js = resp.json()
+    js = json_loads(resp.content)
     return js
 
 
 # 4. Map JSON to a row in weather_daily
 
 
-def transform_weather_row(d: dt.date, js: dict):
+def transform_weather_row(d: dt.date, day):
     """
+    day: the entry of the API's "days" list for date d, or None if it is missing
+
     weather_daily ：
 
     weather_date DATE PRIMARY KEY,
@@ -130,8 +205,7 @@ def transform_weather_row(d: dt.date, js: dict):
     is_rain      TINYINT
     """
 
-    days = js.get("days", [])
-    if not days:
+    if not day:
         # If there is no data on that day, use all NULL + label text
         return (
             d,
@@ -145,8 +219,6 @@ def transform_weather_row(d: dt.date, js: dict):
             0,
         )
 
-    day = days[0]
-
     tempmax = day.get("tempmax")
     tempmin = day.get("tempmin")
     temp = day.get("temp")
@@ -215,7 +287,7 @@ def insert_weather_daily(conn, rows):
 
 
 def lambda_handler(event, context):
-    conn = get_connection()
+    conn = get_reusable_connection()
     try:
         start_date, end_date = get_date_range(conn)
         if start_date is None:
@@ -225,26 +297,27 @@ def lambda_handler(event, context):
 
         logger.info(f"Fetching weather from {start_date} to {end_date}")
 
-        cur_date = start_date
         total_inserted = 0
 
-        while cur_date <= end_date:
+        # Chunks are loaded (and committed) in order, and a failed chunk ends the
+        # run: get_date_range resumes from MAX(weather_date), so a later chunk
+        # must not be committed past it
+        for chunk_start, chunk_end in create_date_ranges(start_date, end_date):
             try:
-                logger.info(f"==== {cur_date} ====")
+                js = fetch_weather_range(chunk_start, chunk_end)
+                days_by_date = {day.get("datetime"): day for day in js.get("days", [])}
 
-                js = fetch_weather_for_date(cur_date)
-                row = transform_weather_row(cur_date, js)
-                inserted = insert_weather_daily(conn, [row])
-                total_inserted += inserted
+                rows = []
+                cur_date = chunk_start
+                while cur_date <= chunk_end:
+                    rows.append(transform_weather_row(cur_date, days_by_date.get(cur_date.isoformat())))
+                    cur_date += dt.timedelta(days=1)
 
-                logger.info(
-                    f"{cur_date}: fetched 1 day, inserted {inserted} row into weather_daily"
-                )
+                total_inserted += insert_weather_daily(conn, rows)
 
             except Exception as e:
-                logger.error(f"Error processing weather for {cur_date}: {e}")
-
-            cur_date += dt.timedelta(days=1)
+                logger.error(f"Error processing weather from {chunk_start} to {chunk_end}: {e}")
+                break
 
         result_msg = (
             f"Inserted/updated {total_inserted} rows into weather_daily "
@@ -258,4 +331,9 @@ def lambda_handler(event, context):
         }
 
     finally:
-        conn.close()
+        # The connection stays open for the next invocation; end any open
+        # transaction so its snapshot does not leak into the next run
+        try:
+            conn.rollback()
+        except pymysql.MySQLError:
+            pass
@@ -1,7 +1,13 @@
 import os
+import csv
+import json
 import math
+import tempfile
+import importlib.util
+import datetime as dt
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlalchemy import create_engine, text
 
 # Optional: load .env locally
@@ -11,6 +17,16 @@ try:
 except Exception:
     pass
 
+# orjson parses JSON several times faster; fall back to the stdlib json if it is not packaged
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# mysqlclient (C extension) encodes and sends rows faster than PyMySQL; use it when installed
+DB_DRIVER = "mysqldb" if importlib.util.find_spec("MySQLdb") else "pymysql"
+
 
 def make_engine():
     host = os.getenv("DB_HOST")
@@ -25,8 +41,10 @@ def make_engine():
     if missing:
         raise ValueError(f"Missing env vars: {', '.join(missing)}")
 
-    url = f"mysql+mysqlconnector://{user}:{pwd}@{host}:{port}/{db}"
-    return create_engine(url)
+    # local_infile lets upsert_violations bulk-load with LOAD DATA LOCAL INFILE
+    # (the server must also have local_infile=1)
+    url = f"mysql+{DB_DRIVER}://{user}:{pwd}@{host}:{port}/{db}"
+    return create_engine(url, pool_size=4, pool_pre_ping=True, connect_args={"local_infile": 1})
 
 
 ENGINE = make_engine()
@@ -38,8 +56,24 @@ LAYER_2024 = {"2024-09": 8, "2024-10": 9, "2024-11": 10, "2024-12": 11}
 LAYER_2025 = {"2025-01": 0, "2025-02": 1, "2025-03": 2, "2025-04": 3, "2025-05": 4, "2025-06": 5,
               "2025-07": 6, "2025-08": 7, "2025-09": 8, "2025-10": 9, "2025-11": 10, "2025-12": 11}
 
+# month_key -> (MapServer URL, layer ID)
+LAYERS = {
+    **{k: (URL_2024, v) for k, v in LAYER_2024.items()},
+    **{k: (URL_2025, v) for k, v in LAYER_2025.items()},
+}
+
 CHUNK = 2000
 
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+    ),
+)
+
 
 def ensure_violations_table():
     ddl = """
@@ -65,12 +99,54 @@ def ensure_violations_table():
 
 
 def get_layer_url(month_key: str):
-    if month_key.startswith("2024"):
-        return URL_2024, LAYER_2024[month_key]
-    return URL_2025, LAYER_2025[month_key]
-
-
-def fetch_month(month_key: str) -> pd.DataFrame:
+    return LAYERS[month_key]
+
+
+def to_float_safe(x):
+    if x is None:
+        return None
+    try:
+        f = float(x)
+        if math.isnan(f):
+            return None
+        return f
+    except (TypeError, ValueError):
+        return None
+
+
+def ms_to_datetime(ms_value):
+    """ArcGIS ISSUE_DATE: UTC millisecond timestamp -> (naive UTC datetime, date)"""
+    if ms_value is None:
+        return None, None
+    try:
+        dt_val = dt.datetime.fromtimestamp(float(ms_value) / 1000.0, dt.timezone.utc).replace(tzinfo=None)
+        return dt_val, dt_val.date()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None, None
+
+
+def transform_row(a: dict, month_key: str):
+    """One ArcGIS attributes dict -> one violations tuple, in LOAD_COLUMNS order"""
+    issue_date, violation_date = ms_to_datetime(a.get("ISSUE_DATE"))
+    return (
+        str(a.get("VIOLATION_ID") or ""),
+        issue_date,
+        violation_date,
+        a.get("ISSUING_AGENCY_NAME"),
+        a.get("ACCIDENT_INDICATOR"),
+        a.get("LOCATION"),
+        a.get("VIOLATION_CODE"),
+        a.get("VIOLATION_DESC"),
+        to_float_safe(a.get("FINE_AMOUNT")),
+        to_float_safe(a.get("TOTAL_PAID")),
+        to_float_safe(a.get("LATITUDE")),
+        to_float_safe(a.get("LONGITUDE")),
+        month_key,
+    )
+
+
+def fetch_month(month_key: str):
+    """Yield one list of violations tuples per ArcGIS page, so each page is written before the next is fetched"""
     base_url, layer_id = get_layer_url(month_key)
     url = f"{base_url}/{layer_id}/query"
 
@@ -80,61 +156,77 @@ def fetch_month(month_key: str) -> pd.DataFrame:
         "returnCountOnly": "true",
         "f": "json",
     }
-    r = requests.get(url, params=params_count, timeout=60)
+    r = SESSION.get(url, params=params_count, timeout=60)
     r.raise_for_status()
-    total = r.json().get("count", 0)
-
-    if total == 0:
-        return pd.DataFrame()
+    total = json_loads(r.content).get("count", 0)
 
     pages = math.ceil(total / CHUNK)
-    rows = []
 
     for i in range(pages):
         params = {
             "where": "1=1",
             "outFields": "*",
+            "returnGeometry": "false",
             "f": "json",
             "resultOffset": i * CHUNK,
             "resultRecordCount": CHUNK,
         }
-        resp = requests.get(url, params=params, timeout=60)
+        resp = SESSION.get(url, params=params, timeout=60)
         resp.raise_for_status()
-        feats = resp.json().get("features", [])
-
-        for f in feats:
-            a = f.get("attributes", {})
-            rows.append({
-                "violation_id": str(a.get("violation_id") or a.get("VIOLATION_ID") or ""),
-                "issue_date": a.get("issue_date") or a.get("ISSUE_DATE"),
-                "violation_date": a.get("violation_date") or a.get("VIOLATION_DATE"),
-                "issuing_agency_name": a.get("issuing_agency_name") or a.get("ISSUING_AGENCY_NAME"),
-                "accident_indicator": a.get("accident_indicator") or a.get("ACCIDENT_INDICATOR"),
-                "location": a.get("location") or a.get("LOCATION"),
-                "violation_code": a.get("violation_code") or a.get("VIOLATION_CODE"),
-                "violation_desc": a.get("violation_desc") or a.get("VIOLATION_DESC"),
-                "fine_amount": a.get("fine_amount") or a.get("FINE_AMOUNT"),
-                "total_paid": a.get("total_paid") or a.get("TOTAL_PAID"),
-                "latitude": a.get("latitude") or a.get("LATITUDE"),
-                "longitude": a.get("longitude") or a.get("LONGITUDE"),
-                "month": month_key,
-            })
-
-    df = pd.DataFrame(rows)
-    return df[df["violation_id"].astype(str).str.len() > 0].copy()
-
-
-def upsert_violations(df: pd.DataFrame):
-    if df.empty:
+        feats = json_loads(resp.content).get("features", [])
+
+        rows = (transform_row(f.get("attributes", {}), month_key) for f in feats)
+        yield [row for row in rows if row[0]]
+
+
+LOAD_COLUMNS = [
+    "violation_id", "issue_date", "violation_date", "issuing_agency_name", "accident_indicator",
+    "location", "violation_code", "violation_desc", "fine_amount", "total_paid", "latitude", "longitude", "month",
+]
+
+
+def to_load_field(v):
+    r"""
+    Spell one value the way LOAD DATA reads it back with ESCAPED BY '\':
+    NULL becomes \N, and backslashes in text are doubled so they load literally
+    """
+    if v is None:
+        return "\\N"
+    if isinstance(v, str):
+        return v.replace("\\", "\\\\")
+    return v
+
+
+def upsert_violations(conn, rows: list):
+    """
+    Bulk-load rows (tuples in LOAD_COLUMNS order) into a temporary staging table with
+    LOAD DATA LOCAL INFILE, then merge it into violations with
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE, inside the caller's transaction on conn.
+
+    Staged rows identical to the stored ones are filtered out before the merge, so
+    reloading an unchanged month does not rewrite those rows.
+    """
+    if not rows:
         return 0
 
-    insert_sql = """
-    INSERT INTO violations
-    (violation_id, issue_date, violation_date, issuing_agency_name, accident_indicator,
-     location, violation_code, violation_desc, fine_amount, total_paid, latitude, longitude, month)
-    VALUES
-    (:violation_id, :issue_date, :violation_date, :issuing_agency_name, :accident_indicator,
-     :location, :violation_code, :violation_desc, :fine_amount, :total_paid, :latitude, :longitude, :month)
+    columns = ", ".join(LOAD_COLUMNS)
+    load_sql = f"""
+    LOAD DATA LOCAL INFILE :path
+    INTO TABLE violations_stage
+    FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY '\\\\'
+    LINES TERMINATED BY '\\n'
+    ({columns})
+    """
+    staged_columns = ", ".join(f"s.{c}" for c in LOAD_COLUMNS)
+    unchanged = " AND ".join(f"s.{c} <=> v.{c}" for c in LOAD_COLUMNS[1:])
+    merge_sql = f"""
+    INSERT INTO violations ({columns})
+    SELECT {columns} FROM (
+        SELECT {staged_columns}
+        FROM violations_stage s
+        LEFT JOIN violations v ON v.violation_id = s.violation_id
+        WHERE v.violation_id IS NULL OR NOT ({unchanged})
+    ) AS changed
     ON DUPLICATE KEY UPDATE
       issue_date=VALUES(issue_date),
       violation_date=VALUES(violation_date),
@@ -149,22 +241,38 @@ def upsert_violations(df: pd.DataFrame):
       longitude=VALUES(longitude),
       month=VALUES(month);
     """
-    with ENGINE.begin() as conn:
-        conn.execute(text(insert_sql), df.to_dict(orient="records"))
-    return len(df)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", newline="", encoding="utf-8", delete=False) as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerows([to_load_field(v) for v in row] for row in rows)
+        path = f.name
+
+    try:
+        # Temporary tables live per connection, so a pooled connection may already have one
+        conn.execute(text("CREATE TEMPORARY TABLE IF NOT EXISTS violations_stage LIKE violations"))
+        conn.execute(text("DELETE FROM violations_stage"))
+        conn.execute(text(load_sql), {"path": path})
+        conn.execute(text(merge_sql))
+    finally:
+        os.remove(path)
+
+    return len(rows)
 
 
 def main():
     ensure_violations_table()
 
-    months = list(LAYER_2024.keys()) + list(LAYER_2025.keys())
+    months = list(LAYERS)
     total = 0
 
-    for m in months:
-        df = fetch_month(m)
-        processed = upsert_violations(df)
-        total += processed
-        print(f"[{m}] rows processed: {len(df)}")
+    # One transaction (and one commit) for the whole history load
+    with ENGINE.begin() as conn:
+        for m in months:
+            processed = 0
+            for rows in fetch_month(m):
+                processed += upsert_violations(conn, rows)
+            total += processed
+            print(f"[{m}] rows processed: {processed}")
 
     print(f"Done. Total rows processed: {total}")
 
@@ -1,7 +1,11 @@
 import os
+import json
+import importlib.util
 import requests
 import pandas as pd
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlalchemy import create_engine, text
 
 # Optional: load .env locally (recommended)
@@ -11,6 +15,16 @@ try:
 except Exception:
     pass
 
+# orjson parses JSON several times faster; fall back to the stdlib json if it is not packaged
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# mysqlclient (C extension) encodes and sends rows faster than PyMySQL; use it when installed
+DB_DRIVER = "mysqldb" if importlib.util.find_spec("MySQLdb") else "pymysql"
+
 
 def make_engine():
     host = os.getenv("DB_HOST")
@@ -25,12 +39,23 @@ def make_engine():
     if missing:
         raise ValueError(f"Missing env vars: {', '.join(missing)}")
 
-    url = f"mysql+mysqlconnector://{user}:{pwd}@{host}:{port}/{db}"
-    return create_engine(url)
+    # Both drivers rewrite INSERT ... VALUES executemany calls into multi-row statements
+    url = f"mysql+{DB_DRIVER}://{user}:{pwd}@{host}:{port}/{db}"
+    return create_engine(url, pool_size=4, pool_pre_ping=True)
 
 
 ENGINE = make_engine()
 
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+    ),
+)
+
 
 def ensure_weather_table():
     ddl = """
@@ -66,25 +91,21 @@ def fetch_weather_chunk(location, start_date, end_date, api_key):
     url = f"{base_url}/{location}/{start_date}/{end_date}"
     params = {"unitGroup": "us", "include": "days", "key": api_key, "contentType": "json"}
 
-    r = requests.get(url, params=params, timeout=60)
+    r = SESSION.get(url, params=params, timeout=60)
     r.raise_for_status()
-    data = r.json()
+    data = json_loads(r.content)
 
     days = data.get("days", [])
-    rows = []
-    for d in days:
-        rows.append({
-            "weather_date": d.get("datetime"),
-            "tempmax": d.get("tempmax"),
-            "tempmin": d.get("tempmin"),
-            "temp": d.get("temp"),
-            "precip": d.get("precip"),
-            "humidity": d.get("humidity"),
-            "windspeed": d.get("windspeed"),
-            "conditions": d.get("conditions"),
-            "is_rain": 1 if (d.get("precip") or 0) > 0 else 0
-        })
-    return pd.DataFrame(rows)
+    df = pd.DataFrame(days, columns=["datetime", "tempmax", "tempmin", "temp", "precip",
+                                     "humidity", "windspeed", "conditions"])
+    df = df.rename(columns={"datetime": "weather_date"})
+
+    # Rainy if there is precipitation or the conditions text mentions rain (same rule as the daily Lambda)
+    df["is_rain"] = (
+        (pd.to_numeric(df["precip"], errors="coerce").fillna(0) > 0)
+        | df["conditions"].fillna("").astype(str).str.contains("rain", case=False, regex=False)
+    ).astype("int8")
+    return df
 
 
 def upsert_weather(df: pd.DataFrame):